@@ -0,0 +1,30 @@
+# gunicorn_conf.py
+# Production server settings: gunicorn manages the processes, uvicorn workers serve the app.
+# Run with (from the project directory):
+# gunicorn -c gunicorn_conf.py main:app
+import multiprocessing
+import os
+
+from uvicorn_worker import UvicornWorker
+
+
+class UvloopHttptoolsWorker(UvicornWorker):
+    """
+    Uvicorn worker pinned to the uvloop event loop and the httptools HTTP parser,
+    instead of letting uvicorn fall back to asyncio/h11 if they fail to import.
+    """
+    CONFIG_KWARGS = {**UvicornWorker.CONFIG_KWARGS, "loop": "uvloop", "http": "httptools"}
+
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+worker_class = "gunicorn_conf.UvloopHttptoolsWorker"
+# One worker per core by default (override with WEB_CONCURRENCY)
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+
+# Every worker keeps its own pool of Tesseract APIs (see processing.py). Split the cores
+# between them so workers * OCR_POOL_SIZE stays close to the core count; the workers
+# inherit this environment when they are forked.
+os.environ.setdefault("OCR_POOL_SIZE", str(max(1, multiprocessing.cpu_count() // workers)))
+
+# OCR of a large report can take several seconds
+timeout = int(os.environ.get("TIMEOUT", 120))
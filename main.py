@@ -1,50 +1,145 @@
 # main.py
 from fastapi import FastAPI, File, UploadFile, HTTPException
 from typing import List
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import logging
 import os
-import traceback # For detailed error logging
 
 # Import Pydantic models and processing functions
 from models import ApiResponse, LabTest
-from processing import process_lab_report # Import the main processing function
+from processing import process_lab_report, OCR_POOL_SIZE # Import the main processing function
 
+# Application log level (DEBUG shows per-request pipeline steps); uvicorn's own loggers are separate
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO"), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logger = logging.getLogger(__name__)
+
+# No custom default_response_class (e.g. ORJSONResponse): because every endpoint declares a
+# response_model, FastAPI (>= 0.130) serializes the result straight to JSON bytes with
+# Pydantic's Rust core, and setting a response class would switch that fast path off.
+# The response field is built once per route at startup, and validating the ApiResponse
+# instances the endpoints return (built with model_construct) is a pass-through, so keeping
+# response_model costs nothing per request and keeps the schema in the OpenAPI docs.
 app = FastAPI(title="Bajaj Lab Report OCR API (Pillow)")
 
-@app.post("/get-lab-tests",
-          response_model=ApiResponse,
-          summary="Extract Lab Tests from Image",
-          description="Upload a lab report image (PNG, JPG, JPEG) to extract test names, values, units, and reference ranges.")
-async def get_lab_tests_endpoint(file: UploadFile = File(..., description="Lab report image file.")):
+# Uploads larger than this are rejected with HTTP 413 (override with MAX_UPLOAD_BYTES)
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", 20 * 1024 * 1024))
+
+# OCR is blocking, CPU-bound work (tesserocr releases the GIL while recognising), so it runs
+# in its own thread pool sized to the Tesseract API pool. This keeps the event loop free and
+# stops long OCR jobs from starving FastAPI's default threadpool.
+ocr_executor = ThreadPoolExecutor(max_workers=OCR_POOL_SIZE, thread_name_prefix="ocr")
+
+def payload_too_large() -> HTTPException:
+    return HTTPException(status_code=413, detail=f"File too large. Maximum size is {MAX_UPLOAD_BYTES} bytes.")
+
+def check_upload_size(file: UploadFile) -> None:
+    """Rejects uploads already known to be larger than MAX_UPLOAD_BYTES with HTTP 413."""
+    # The multipart parser usually knows the size already, so most oversize uploads never get read
+    if file.size is not None and file.size > MAX_UPLOAD_BYTES:
+        raise payload_too_large()
+
+async def read_upload_limited(file: UploadFile) -> bytes:
     """
-    Endpoint to process a lab report image and extract structured data.
+    Reads the uploaded file, rejecting it with HTTP 413 if it is larger than
+    MAX_UPLOAD_BYTES. Returns the whole file as one bytes object.
     """
-    if not file.content_type in ["image/png", "image/jpeg", "image/jpg"]:
+    check_upload_size(file)
+
+    # One read capped at one byte over the limit: a single allocation, and an upload whose
+    # size was not known up front still cannot be read past MAX_UPLOAD_BYTES + 1 bytes.
+    # The cap is lowered to the known size because read(n) allocates n bytes up front.
+    # The result is bytes, which io.BytesIO in preprocessing shares instead of copying.
+    read_limit = MAX_UPLOAD_BYTES if file.size is None else min(file.size, MAX_UPLOAD_BYTES)
+    image_bytes = await file.read(read_limit + 1)
+    if len(image_bytes) > MAX_UPLOAD_BYTES:
+        raise payload_too_large()
+    return image_bytes
+
+ALLOWED_CONTENT_TYPES = ["image/png", "image/jpeg", "image/jpg"]
+
+def check_content_type(file: UploadFile) -> None:
+    """Rejects uploads that are not PNG/JPEG images with HTTP 400."""
+    if not file.content_type in ALLOWED_CONTENT_TYPES:
         raise HTTPException(status_code=400, detail="Invalid file type. Please upload PNG, JPG, or JPEG images.")
 
+async def process_upload(file: UploadFile) -> ApiResponse:
+    """
+    Reads one uploaded lab report image and runs it through the OCR pipeline.
+    Processing errors are returned as an unsuccessful ApiResponse.
+    """
     try:
-        # Read image bytes directly into memory
-        image_bytes = await file.read()
+        # Read the image bytes, rejecting oversize uploads with 413
+        image_bytes = await read_upload_limited(file)
 
         # ---- Call the core processing logic ----
-        print(f"Processing file: {file.filename} ({file.content_type})")
-        extracted_data: List[LabTest] = process_lab_report(image_bytes)
-        print(f"Extracted {len(extracted_data)} potential tests.")
+        logger.debug("Processing file: %s (%s)", file.filename, file.content_type)
+        loop = asyncio.get_running_loop()
+        extracted_data: List[LabTest] = await loop.run_in_executor(ocr_executor, process_lab_report, image_bytes)
+        logger.debug("Extracted %d potential tests.", len(extracted_data))
         # ---- End processing logic call ----
 
-        return ApiResponse(is_success=True, data=extracted_data)
+        # The LabTest objects are already built, so skip re-validating them
+        return ApiResponse.model_construct(is_success=True, data=extracted_data)
+
+    except HTTPException:
+        # Client errors (e.g. oversize upload) keep their HTTP status
+        raise
 
-    except Exception as e:
+    except Exception:
         # Log the detailed error for debugging
-        print(f"Error processing file: {file.filename}")
-        print(traceback.format_exc()) # Print full traceback
+        logger.exception("Error processing file: %s", file.filename) # Logs the full traceback
 
         # Return a structured failure response
-        return ApiResponse(is_success=False, data=[])
+        return ApiResponse.model_construct(is_success=False, data=[])
 
     finally:
         # Ensure the uploaded file stream is closed
         await file.close()
-        print(f"Finished processing request for: {file.filename}")
+        logger.debug("Finished processing request for: %s", file.filename)
+
+@app.post("/get-lab-tests",
+          response_model=ApiResponse,
+          summary="Extract Lab Tests from Image",
+          description="Upload a lab report image (PNG, JPG, JPEG) to extract test names, values, units, and reference ranges.")
+async def get_lab_tests_endpoint(file: UploadFile = File(..., description="Lab report image file.")):
+    """
+    Endpoint to process a lab report image and extract structured data.
+    """
+    check_content_type(file)
+    return await process_upload(file)
+
+
+@app.post("/get-lab-tests/batch",
+          response_model=List[ApiResponse],
+          summary="Extract Lab Tests from Multiple Images",
+          description="Upload several lab report images (PNG, JPG, JPEG). They are OCR'd in parallel and one result is returned per file, in upload order.")
+async def get_lab_tests_batch_endpoint(files: List[UploadFile] = File(..., description="Lab report image files.")):
+    """
+    Endpoint to process several lab report images concurrently.
+    """
+    # Validate every file before any OCR work starts
+    for file in files:
+        check_content_type(file)
+        check_upload_size(file)
+
+    # Bounds how many of this request's files are read into memory and queued for OCR at once.
+    # Created per request: an asyncio.Semaphore binds to the event loop it is first used on
+    # (ocr_executor already caps OCR concurrency for the whole process).
+    batch_semaphore = asyncio.Semaphore(OCR_POOL_SIZE)
+
+    async def process_with_limit(file: UploadFile) -> ApiResponse:
+        async with batch_semaphore:
+            return await process_upload(file)
+
+    # A file can still fail while it is read (size unknown up front). The TaskGroup then
+    # cancels the other files instead of letting them read and OCR for a failed request.
+    try:
+        async with asyncio.TaskGroup() as task_group:
+            tasks = [task_group.create_task(process_with_limit(file)) for file in files]
+    except* HTTPException as errors:
+        raise errors.exceptions[0]
+    return [task.result() for task in tasks]
 
 
 @app.get("/", summary="API Root", description="Basic check to see if the API is running.")
@@ -55,4 +150,6 @@ def read_root():
     return {"message": "Bajaj Lab Report OCR API is running. Use the /docs endpoint for API documentation."}
 
 # Command to run (from the bajaj_lab_report_ocr directory):
-# uvicorn main:app --reload --host localhost --port 8000
\ No newline at end of file
+# uvicorn main:app --reload --host localhost --port 8000
+# Production (uvloop + httptools, one worker per core):
+# gunicorn -c gunicorn_conf.py main:app
\ No newline at end of file
@@ -1,161 +1,288 @@
 # processing.py
 # Using Pillow (PIL) instead of OpenCV
+import os
+
+# Tesseract's OpenMP parallelism is disabled so every pooled API uses exactly one core;
+# concurrency comes from running several APIs side by side instead (see _API_POOL below).
+# This must be set before libtesseract is loaded.
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
 from PIL import Image, ImageOps # Import Pillow
-import pytesseract
-from typing import List, Optional, Dict, Any
+import numpy as np # Vectorized pixel operations (binarization) and range checks
+from tesserocr import PyTessBaseAPI, PSM, OEM # In-process bindings to libtesseract
+from cachetools import LRUCache
+from concurrent.futures import ThreadPoolExecutor
+import blake3 # Fast content hash for the result cache
+from typing import Iterator, List, Optional, Dict, Any, Tuple
+import functools
 import io # To handle bytes as file-like object for Pillow
+import logging
+import math
+import queue
 import re
-import traceback
+import threading
 
 # Import models for type hinting
 from models import LabTest
 
-# --- Optional: Configure Tesseract Path ---
-# If Tesseract is not in your PATH, uncomment and set the correct path
-# Example for Windows:
-pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
-# Example for Linux (if installed in a non-standard location):
-# pytesseract.pytesseract.tesseract_cmd = '/usr/local/bin/tesseract'
+# Lazy %-style formatting: messages below the configured level are never built
+logger = logging.getLogger(__name__)
+
+# --- Tesseract API pool (in-process via tesserocr) ---
+# The APIs are created once at import, so the 'eng' traineddata is loaded a fixed number
+# of times instead of spawning the tesseract executable (and reloading the model) per request.
+# If Tesseract cannot find its language data, set TESSDATA_PREFIX before starting, e.g.
+# Windows: TESSDATA_PREFIX=C:\Program Files\Tesseract-OCR\tessdata
+# Linux:   TESSDATA_PREFIX=/usr/share/tesseract-ocr/5/tessdata
+# PSM.SINGLE_BLOCK (--psm 6): Assume a single uniform block of text (good for tables)
+# OEM.DEFAULT (--oem 3): Use whichever engine is available (LSTM for current traineddata)
+# These, and TESSERACT_VARIABLES, are applied once when each API is initialised and stay
+# set for every later image; nothing is re-parsed per request.
+#
+# One API can only work on one image at a time, so concurrent requests check an API out
+# of the pool and return it when done. Override the size with the OCR_POOL_SIZE env var.
+# Clamped to at least 1: an empty pool would block every OCR call forever.
+OCR_POOL_SIZE = max(1, int(os.environ.get("OCR_POOL_SIZE", min(os.cpu_count() or 1, 8))))
+
+# tessedit_do_invert=0: by default Tesseract 5 re-recognises every low-confidence line a
+# second time as inverted (light-on-dark) text. Reports are dark text on a light background
+# (and binarized that way in Step 2), so that second pass is wasted work.
+TESSERACT_VARIABLES = {'tessedit_do_invert': '0'}
+
+_API_POOL: "queue.Queue[PyTessBaseAPI]" = queue.Queue()
+for _ in range(OCR_POOL_SIZE):
+    _API_POOL.put(PyTessBaseAPI(lang='eng', psm=PSM.SINGLE_BLOCK, oem=OEM.DEFAULT,
+                                variables=TESSERACT_VARIABLES))
 
 # --- Step 2 (Revised): Image Preprocessing using Pillow ---
+# Tesseract's runtime grows with pixel count; ~2000px on the long side keeps report text
+# at a readable size while phone photos (often 4000x3000) are cut to a quarter of the pixels.
+MAX_OCR_SIDE = 2000
+
 def preprocess_image(image_bytes: bytes) -> Image.Image:
     """
-    Loads image from bytes using Pillow, converts to grayscale.
+    Loads image from bytes using Pillow (JPEGs are decoded in draft mode),
+    converts to grayscale and downscales it so the longest side is at most
+    MAX_OCR_SIDE pixels.
     Potentially add more preprocessing steps here later.
     Returns a Pillow Image object.
     """
     try:
-        # Open image bytes with Pillow
+        # Open image bytes with Pillow (BytesIO shares the buffer of a bytes object, no copy)
         img = Image.open(io.BytesIO(image_bytes))
 
+        # For JPEGs, ask libjpeg to decode straight to grayscale and, for oversized images, at a
+        # reduced scale (1/2, 1/4 or 1/8, never below the OCR target size) during the DCT
+        # itself. Other formats ignore draft().
+        scale = MAX_OCR_SIDE / max(img.size)
+        draft_size = (math.ceil(img.width * scale), math.ceil(img.height * scale)) if scale < 1.0 else None
+        img.draft('L', draft_size)
+
         # Convert to grayscale ('L' mode in Pillow)
         gray_img = img.convert('L')
 
-        # --- Potential Future Enhancements (using Pillow) ---
-        # Auto Contrast (often helpful)
-        # contrasted_img = ImageOps.autocontrast(gray_img)
-        # return contrasted_img
+        # Downscale oversized images (grayscale first, so only one channel is resampled)
+        width, height = gray_img.size
+        scale = MAX_OCR_SIDE / max(width, height)
+        if scale < 1.0:
+            new_size = (max(1, int(width * scale)), max(1, int(height * scale)))
+            gray_img = gray_img.resize(new_size, Image.Resampling.LANCZOS)
+            logger.debug("Image preprocessing (Pillow): Downscaled %dx%d -> %dx%d.", width, height, *new_size)
 
-        # Simple Thresholding (Example)
-        # threshold = 128 # Adjust threshold value as needed
-        # thresh_img = gray_img.point(lambda p: p > threshold and 255)
-        # return thresh_img
-        # --- End Enhancements ---
+        # Binarization is done separately in binarize_image(), so the grayscale image
+        # stays available as a fallback for OCR
 
-        print("Image preprocessing (Pillow): Converted to grayscale.")
+        logger.debug("Image preprocessing (Pillow): Converted to grayscale.")
         return gray_img # Return grayscale Pillow image object
 
     except Exception as e:
-        print(f"Error during image preprocessing (Pillow): {e}")
+        logger.error("Error during image preprocessing (Pillow): %s", e)
         # Re-raise the exception to be caught by the main API handler
         raise ValueError(f"Preprocessing failed (Pillow): {e}") from e
 
 
+def binarize_image(gray_img: Image.Image) -> Image.Image:
+    """
+    Binarizes a grayscale Pillow image with Otsu's threshold.
+    The histogram, threshold search and thresholding are all NumPy vector ops.
+    Returns a black-and-white ('L' mode, 0/255) Pillow Image object.
+    """
+    arr = np.asarray(gray_img, dtype=np.uint8)
+    hist = np.bincount(arr.ravel(), minlength=256).astype(np.float64)
+
+    # Class weights and intensity sums for every candidate threshold t (pixels <= t are background)
+    weight_bg = np.cumsum(hist)
+    weight_fg = weight_bg[-1] - weight_bg
+    sum_bg = np.cumsum(hist * np.arange(256))
+    sum_fg = sum_bg[-1] - sum_bg
+
+    # Between-class variance; empty classes give 0/0, which is treated as "no split"
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_diff = sum_bg / weight_bg - sum_fg / weight_fg
+        between_var = np.nan_to_num(weight_bg * weight_fg * mean_diff * mean_diff)
+    threshold = int(np.argmax(between_var))
+
+    binary = (arr > threshold).view(np.uint8) * np.uint8(255)
+    logger.debug("Image preprocessing (NumPy): Otsu threshold %d.", threshold)
+    return Image.fromarray(binary, 'L')
+
+
 # --- Step 3 (Revised): OCR Implementation ---
 def perform_ocr(pil_image: Image.Image) -> str:
     """
-    Performs OCR on the preprocessed Pillow image using pytesseract.
+    Performs OCR on the preprocessed Pillow image using a pooled tesserocr API.
     """
     try:
-        # Configure Tesseract options
-        # --psm 6: Assume a single uniform block of text (good for tables)
-        # Other options: 3 (default), 4 (single column), 11 (sparse text)
-        custom_config = r'--oem 3 --psm 6 -l eng' # OEM 3 is default, PSM 6 for tables, lang eng
-
-        print(f"Performing OCR with config: {custom_config}")
-        # pytesseract works directly with Pillow images
-        text = pytesseract.image_to_string(pil_image, config=custom_config)
+        logger.debug("Performing OCR with tesserocr (psm=SINGLE_BLOCK, oem=DEFAULT, lang=eng)")
+        # tesserocr works directly with Pillow images
+        # Blocks until an API is free; tesserocr releases the GIL while recognising
+        api = _API_POOL.get()
+        try:
+            api.SetImage(pil_image)
+            text = api.GetUTF8Text()
+        finally:
+            _API_POOL.put(api)
 
         if not text or text.isspace():
-             print("Warning: OCR returned empty or whitespace string.")
+             logger.warning("OCR returned empty or whitespace string.")
         else:
-            print(f"OCR successful, extracted {len(text)} characters.")
-            # print("---- OCR Output Start ----")
-            # print(text[:500] + "...") # Print start of OCR text for debugging
-            # print("---- OCR Output End ----")
+            logger.debug("OCR successful, extracted %d characters.", len(text))
+            # logger.debug("---- OCR Output Start ----\n%s...\n---- OCR Output End ----", text[:500]) # Start of OCR text for debugging
 
         return text
 
-    except pytesseract.TesseractNotFoundError:
-        print("ERROR: Tesseract executable not found. Ensure Tesseract is installed and in PATH or configure pytesseract.pytesseract.tesseract_cmd")
-        raise RuntimeError("Tesseract OCR engine not found.")
     except Exception as e:
-        print(f"Error during OCR: {e}")
+        logger.error("Error during OCR: %s", e)
         raise RuntimeError(f"OCR failed: {e}") from e
 
 
 # --- Step 4: Core Parsing Logic ---
 # Define Regex Patterns (Compile for efficiency)
-VALUE_RE = re.compile(r'(\b\d+\.\d+\b|\b\d+\b|\b[Pp]ositive\b|\b[Nn]egative\b|\b[Dd]etected\b|\b[Nn]on [Rr]eactive\b|\b[Rr]eactive\b|\b[Nn]ormal\b|\b[Aa]bnornmal\b)', re.IGNORECASE)
-UNIT_RE = re.compile(r'\b(%|g/dL|gm/dL|mg/dL|Seconds|U/L|IU/L|fl|fL|cu\.?mm|cells/µL|cells/ul|million/cu\.?mm|mEq/Litre|mmol/L|pg/mL|ng/mL|H\.P\.F\.|/HPF)\b', re.IGNORECASE)
-RANGE_RE = re.compile(r'(\b\d+\.?\d*\s*-\s*\d+\.?\d*\b|<\s*\d+\.?\d*|>\s*\d+\.?\d*|\b\d+-\d+\b|[Uu]p [Tt]o \d+\.?\d*|\b[Nn]egative\b|\b[Nn]ormal\b)', re.IGNORECASE)
+# These stay on the stdlib re engine: none of the patterns can backtrack badly (every
+# repeat is anchored by \b or a literal), and google-re2's Python wrapper was measured at
+# ~2x slower on short OCR lines, with ASCII-only \b/\d that changes which tokens match.
+# Each pattern starts with a lookahead on the possible first characters (case-insensitive
+# like the patterns themselves), so the engine rejects most start positions with a single
+# character-class test instead of trying every alternative there.
+VALUE_PATTERN = r'(?=[\dpndra])\b(?:\d+\.\d+|\d+|[Pp]ositive|[Nn]egative|[Dd]etected|[Nn]on [Rr]eactive|[Rr]eactive|[Nn]ormal|[Aa]bnornmal)\b'
+UNIT_PATTERN = r'(?=[%gmsuifcpnh/])(?:%|g/dL|gm/dL|mg/dL|Seconds|U/L|IU/L|fl|fL|cu\.?mm|cells/µL|cells/ul|million/cu\.?mm|mEq/Litre|mmol/L|pg/mL|ng/mL|H\.P\.F\.|/HPF)'
+UNIT_RE = re.compile(rf'\b({UNIT_PATTERN})\b', re.IGNORECASE)
+RANGE_RE = re.compile(r'(?=[\d<>un])(\b\d+\.?\d*\s*-\s*\d+\.?\d*\b|[<>]\s*\d+\.?\d*|[Uu]p [Tt]o \d+\.?\d*|\b[Nn]egative\b|\b[Nn]ormal\b)', re.IGNORECASE)
+# Values and units can never overlap, so a single finditer pass over the line yields the
+# first value and the first unit (same results as searching for VALUE_PATTERN and UNIT_RE
+# separately).
+# Ranges are kept separate: they start with a value token (e.g. "<5.7", "70-110") and the
+# value would be lost if both had to share one non-overlapping scan. RANGE_RE is instead
+# only run where its result is used.
+LINE_RE = re.compile(rf'(?P<value>{VALUE_PATTERN})|\b(?P<unit>{UNIT_PATTERN})\b', re.IGNORECASE)
+# Prefilter: a value (and so a range) needs a digit or one of the text values, so most
+# name/label lines can skip the value and range regexes. Hints are lowercase substrings of
+# every text value in VALUE_PATTERN ("reactive" covers "non reactive").
+DIGITS = frozenset('0123456789')
+TEXT_VALUE_HINTS = ('positive', 'negative', 'detected', 'reactive', 'normal', 'abnornmal')
+# Test name cleanup: trailing punctuation/OCR noise, and the "has a real word" check
+TRAIL_JUNK_RE = re.compile(r'[^\w\s\(\)-]+$')
+HAS_WORD_RE = re.compile(r'[a-zA-Z]{3,}')
+# Name-like lines (a pending test name): letters, spaces, brackets, hyphens and '#'
+NAMELIKE_HASH_RE = re.compile(r'^[A-Za-z\s\(\)\-\#]+')
 IGNORE_KEYWORDS = ["test", "investigation", "result", "unit", "range", "reference", "interval", "method", "specimen", "serum", "plasma", "blood", "urine", "report", "page", "date", "patient", "doctor", "hospital", "pathology", "signature", "-------", "======", "*******", "end of report", "authorized", "technologist"]
+IGNORE_SET = frozenset(IGNORE_KEYWORDS)
+# A line made only of separator characters can only contain the keywords that are
+# separator runs themselves ("-------", "======", "*******")
+SEPARATOR_CHARS = '- =_*'
+SEPARATOR_KEYWORDS = tuple(k for k in IGNORE_KEYWORDS if not k.strip(SEPARATOR_CHARS))
+# Table header rows, e.g. "Test Name Result Unit Bio. Ref. Range" / "Investigation Result Unit Range"
+TEST_HEADER_RE = re.compile(r'test(\s+name)?\s+result\s+unit\s+(bio\.\s+)?ref.*range.*')
+INVESTIGATION_HEADER_RE = re.compile(r'investigation\s+result\s+unit\s+range.*')
+
+def cannot_contain_value(text: str) -> bool:
+    """
+    Cheap check that VALUE_PATTERN cannot match anywhere in text (no digit, no text value).
+    Only decides for ASCII text: the regex digit class and the case-insensitive words also
+    match non-ASCII characters, which a plain character check would miss.
+    """
+    if not text.isascii() or not DIGITS.isdisjoint(text):
+        return False
+    text_lower = text.lower()
+    return not any(hint in text_lower for hint in TEXT_VALUE_HINTS)
 
+# Letterheads, table headers and footers repeat on every page and every report from a lab
+@functools.lru_cache(maxsize=2048)
 def is_likely_header_or_footer(line: str) -> bool:
     """Checks if a line is likely ignorable header/footer content."""
     line_lower = line.strip().lower()
     if not line_lower: # Skip empty lines
         return True
-    if any(keyword in line_lower for keyword in IGNORE_KEYWORDS) and len(line_lower.split()) < 5 :
-         if re.fullmatch(r'test(\s+name)?\s+result\s+unit\s+(bio\.\s+)?ref.*range.*', line_lower):
+    tokens = line_lower.split()
+    if len(tokens) >= 5: # Only short lines are treated as headers/footers
+        return False
+    # Both header patterns start with a keyword token ("test", "investigation"), so a
+    # C-level set check rules out most lines before any regex runs
+    if not IGNORE_SET.isdisjoint(tokens):
+         if TEST_HEADER_RE.fullmatch(line_lower):
              return True
-         if re.fullmatch(r'investigation\s+result\s+unit\s+range.*', line_lower):
+         if INVESTIGATION_HEADER_RE.fullmatch(line_lower):
              return True
-         if all(c in '- =_*' for c in line_lower):
-            return True
+    # Separator lines only contain keywords as substrings ("--------"), never as tokens
+    if not line_lower.strip(SEPARATOR_CHARS) and any(k in line_lower for k in SEPARATOR_KEYWORDS):
+        return True
     return False
 
-def parse_text_data(text: str) -> List[Dict[str, Any]]:
+def parse_text_data(text: str) -> Iterator[Dict[str, Any]]:
     """
     Parses raw OCR text to extract structured lab test data using regex and heuristics.
     Focuses on lines that appear to contain test results in a semi-tabular format.
+    Yields one dict per test row, in text order.
     """
-    print("Starting OCR text parsing...")
-    results = []
-    lines = text.splitlines()
+    logger.debug("Starting OCR text parsing...")
+    # Every row needs a value, so empty or value-free OCR output (blank pages, photos,
+    # garbage) is rejected without looking at individual lines
+    if cannot_contain_value(text):
+        return
+    lines = [line.strip() for line in text.splitlines()]
     potential_test_name = None
 
-    for i, line in enumerate(lines):
-        line = line.strip()
-
+    for line in lines:
         if is_likely_header_or_footer(line):
             potential_test_name = None
             continue
 
-        value_match = VALUE_RE.search(line)
-        unit_match = UNIT_RE.search(line)
-        range_match = RANGE_RE.search(line)
+        if cannot_contain_value(line):
+            # No value here, so the line can only be the name of the next test
+            if len(line) > 3 and NAMELIKE_HASH_RE.match(line) and not UNIT_RE.search(line):
+                potential_test_name = line
+            else:
+                potential_test_name = None
+            continue
+
+        value_match = None
+        unit_match = None
+        for match in LINE_RE.finditer(line):
+            if match.lastgroup == 'value':
+                value_match = value_match or match
+            else:
+                unit_match = unit_match or match
+            if value_match and unit_match:
+                break
 
         if value_match:
-            value_str = value_match.group(1).strip()
+            value_str = value_match.group('value').strip()
             value_start_index = value_match.start()
-            current_test_name = "Unknown"
             unit_str = None
             range_str = None
 
             if unit_match:
-                unit_str = unit_match.group(1).strip()
-
-            if range_match:
-                 if range_match.start() > value_start_index:
-                     range_str = range_match.group(1).strip()
+                unit_str = unit_match.group('unit').strip()
 
             possible_name_part = line[:value_start_index].strip()
-            cleaned_name = re.sub(r'[^\w\s\(\)-]+$', '', possible_name_part).strip()
+            cleaned_name = TRAIL_JUNK_RE.sub('', possible_name_part).strip()
 
             if cleaned_name and len(cleaned_name) > 2:
-                 if not cleaned_name and i > 0 and not is_likely_header_or_footer(lines[i-1]) and not VALUE_RE.search(lines[i-1]):
-                     potential_previous_name = lines[i-1].strip()
-                     if re.match(r'^[A-Za-z\s\(\)\-]+', potential_previous_name):
-                           current_test_name = potential_previous_name
-                     else:
-                           current_test_name = "Unknown - Check Previous"
-                 else:
-                     current_test_name = cleaned_name
-                     potential_test_name = None
-
-                 if not re.search(r'[a-zA-Z]{3,}', current_test_name):
+                 # A name on the same line always replaces a pending one, even if it is junk
+                 potential_test_name = None
+                 if not HAS_WORD_RE.search(cleaned_name):
                      continue
+                 current_test_name = cleaned_name
 
             elif potential_test_name:
                  current_test_name = potential_test_name
@@ -163,112 +290,239 @@ def parse_text_data(text: str) -> List[Dict[str, Any]]:
             else:
                  continue
 
+            # The range is only looked up for rows that are kept
+            range_match = RANGE_RE.search(line)
+            if range_match:
+                 if range_match.start() > value_start_index:
+                     range_str = range_match.group(1).strip()
+
             extracted = {
                 "test_name": current_test_name,
                 "test_value": value_str,
                 "test_unit": unit_str,
                 "bio_reference_range": range_str
             }
-            results.append(extracted)
+            yield extracted
 
         else:
-             line_trimmed = line.strip()
-             if len(line_trimmed) > 3 and re.match(r'^[A-Za-z\s\(\)\-\#]+', line_trimmed) and not range_match and not unit_match:
-                  potential_test_name = line_trimmed
+             if len(line) > 3 and NAMELIKE_HASH_RE.match(line) and not unit_match and not RANGE_RE.search(line):
+                  potential_test_name = line
              else:
                   potential_test_name = None
 
-    print(f"Parsing finished. Found {len(results)} potential test entries.")
-    return results
-
 
 # --- Step 5: Range Calculation Logic ---
-def calculate_out_of_range(value_str: Optional[str], range_str: Optional[str]) -> Optional[bool]:
-    """
-    Compares a test value string to a reference range string.
-    Returns True (out of range), False (in range), None (cannot compare).
-    """
-    if value_str is None or range_str is None:
-        return None
-
-    value_str_lower = value_str.strip().lower()
-    range_str_lower = range_str.strip().lower()
-
-    if value_str_lower in ["positive", "detected", "reactive"]:
-        return True if range_str_lower == "negative" else None
-    if value_str_lower == "negative":
-        return False if range_str_lower == "negative" else None
-    if range_str_lower in ["negative", "normal"] and not value_str_lower in ["negative", "normal"]:
-         return None
-
+# Done in two phases: classify_range() does the per-row string/regex work and reduces each
+# value/range pair to numbers plus a kind; flag_out_of_range() then compares all rows of a
+# report at once with NumPy vector ops over contiguous value/lo/hi/kind arrays.
+RANGE_NONE = 0     # Cannot compare
+RANGE_BETWEEN = 1  # "lo - hi"
+RANGE_LT = 2       # "< hi"
+RANGE_GT = 3       # "> lo"
+RANGE_UPTO = 4     # "Up to hi"
+RANGE_TRUE = 5     # Textual result decided as out of range (e.g. Positive vs Negative)
+RANGE_FALSE = 6    # Textual result decided as in range (e.g. Negative vs Negative)
+
+_NO_RANGE_ROW = (math.nan, math.nan, math.nan, RANGE_NONE)
+
+# Textual values and ranges
+_POSITIVE_TEXT = frozenset({"positive", "detected", "reactive"})
+_NEGATIVE_TEXT = frozenset({"negative"})
+_NORMAL_TEXT = frozenset({"normal"})
+# (value kind, range kind) pairs that decide a row without any numbers
+_TEXT_DISPATCH = {
+    ("pos", "neg"): (math.nan, math.nan, math.nan, RANGE_TRUE),
+    ("neg", "neg"): (math.nan, math.nan, math.nan, RANGE_FALSE),
+}
+
+def _classify(text_lower: str) -> str:
+    """Returns the kind of a stripped, lowercased value or range: 'pos', 'neg', 'norm' or 'other'."""
+    if text_lower in _POSITIVE_TEXT:
+        return "pos"
+    if text_lower in _NEGATIVE_TEXT:
+        return "neg"
+    if text_lower in _NORMAL_TEXT:
+        return "norm"
+    return "other"
+
+# Numeric reference ranges, tried in this order
+RANGE_BETWEEN_RE = re.compile(r'(\d+\.?\d*)\s*-\s*(\d+\.?\d*)')
+RANGE_LT_RE = re.compile(r'<\s*(\d+\.?\d*)')
+RANGE_GT_RE = re.compile(r'>\s*(\d+\.?\d*)')
+RANGE_UPTO_RE = re.compile(r'[Uu]p [Tt]o (\d+\.?\d*)', re.IGNORECASE)
+
+# The same value and range strings ("13.5 - 17.5", "< 150", "Up to 40") repeat across
+# tests and reports, so each distinct string is parsed once per process
+@functools.lru_cache(maxsize=4096)
+def _parse_value(value_str: str) -> Optional[float]:
+    """Returns the numeric value of a stripped test value (ignoring '<'/'>'), or None if it is not a number."""
     try:
-        cleaned_value_str = re.sub(r'[<>]', '', value_str.strip())
-        value_num = float(cleaned_value_str)
+        # "<5.7" as a value is compared as 5.7; two str.replace calls beat a regex substitution
+        return float(value_str.replace('<', '').replace('>', ''))
     except ValueError:
         return None
 
+@functools.lru_cache(maxsize=4096)
+def _parse_range(range_str: str) -> Tuple[float, float, int]:
+    """Returns the (lo, hi, kind) bounds of a stripped range string; kind is RANGE_NONE if there are none."""
     try:
-        match = re.search(r'(\d+\.?\d*)\s*-\s*(\d+\.?\d*)', range_str)
+        match = RANGE_BETWEEN_RE.search(range_str)
         if match:
-            lower, upper = float(match.group(1)), float(match.group(2))
-            return not (lower <= value_num <= upper)
+            return (float(match.group(1)), float(match.group(2)), RANGE_BETWEEN)
 
-        match = re.search(r'<\s*(\d+\.?\d*)', range_str)
+        match = RANGE_LT_RE.search(range_str)
         if match:
-            upper = float(match.group(1))
-            return value_num >= upper
+            return (math.nan, float(match.group(1)), RANGE_LT)
 
-        match = re.search(r'>\s*(\d+\.?\d*)', range_str)
+        match = RANGE_GT_RE.search(range_str)
         if match:
-            lower = float(match.group(1))
-            return value_num <= lower
+            return (float(match.group(1)), math.nan, RANGE_GT)
 
-        match = re.search(r'[Uu]p [Tt]o (\d+\.?\d*)', range_str, re.IGNORECASE)
+        match = RANGE_UPTO_RE.search(range_str)
         if match:
-            upper = float(match.group(1))
-            return value_num > upper
+            return (math.nan, float(match.group(1)), RANGE_UPTO)
 
     except ValueError:
-        return None
-    except Exception as e:
-        print(f"Unexpected error in calculate_out_of_range for value='{value_str}', range='{range_str}': {e}")
-        return None
+        pass
 
-    return None
+    return (math.nan, math.nan, RANGE_NONE)
+
+def classify_range(value_str: Optional[str], range_str: Optional[str]) -> Tuple[float, float, float, int]:
+    """
+    Parses a test value string and a reference range string for comparison.
+    Returns a (value, lo, hi, kind) row for flag_out_of_range(); unused bounds are NaN.
+    """
+    if value_str is None or range_str is None:
+        return _NO_RANGE_ROW
+
+    # Stripped once; the stripped strings are also the keys of the parse caches
+    value_str = value_str.strip()
+    range_str = range_str.strip()
+    value_kind = _classify(value_str.lower())
+    range_kind = _classify(range_str.lower())
+
+    # Textual results are only decided against a "Negative" range
+    if value_kind == "pos" or value_kind == "neg":
+        return _TEXT_DISPATCH.get((value_kind, range_kind), _NO_RANGE_ROW)
+    # A textual range cannot be compared with a number
+    if range_kind == "neg" or range_kind == "norm":
+         return _NO_RANGE_ROW
+
+    value_num = _parse_value(value_str)
+    if value_num is None:
+        return _NO_RANGE_ROW
+
+    lo, hi, kind = _parse_range(range_str)
+    if kind == RANGE_NONE:
+        return _NO_RANGE_ROW
+    return (value_num, lo, hi, kind)
+
+def classify_ranges(items: List[Dict[str, Any]]) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Classifies the value/range pair of every parsed item.
+    Returns (value, lo, hi, kind) arrays with one entry per item; unused bounds are NaN.
+    """
+    n = len(items)
+    value = np.full(n, np.nan)
+    lo = np.full(n, np.nan)
+    hi = np.full(n, np.nan)
+    kind = np.full(n, RANGE_NONE, dtype=np.int8)
+    for i, item in enumerate(items):
+        value[i], lo[i], hi[i], kind[i] = classify_range(item.get("test_value"), item.get("bio_reference_range"))
+    return value, lo, hi, kind
+
+def flag_out_of_range(value: np.ndarray, lo: np.ndarray, hi: np.ndarray, kind: np.ndarray) -> List[Optional[bool]]:
+    """
+    Compares every classified row in one vectorized pass (see classify_ranges()).
+    Returns True (out of range), False (in range), None (cannot compare) per row.
+    """
+    # The between test is written as "not inside" so a NaN value counts as out of range
+    flags = np.select(
+        [kind == RANGE_BETWEEN, kind == RANGE_LT, kind == RANGE_GT, kind == RANGE_UPTO, kind == RANGE_TRUE],
+        [~((lo <= value) & (value <= hi)), value >= hi, value <= lo, value > hi, True],
+        default=False,
+    )
+    comparable = kind != RANGE_NONE
+    return [flag if ok else None for flag, ok in zip(flags.tolist(), comparable.tolist())]
+
+def calculate_out_of_range(value_str: Optional[str], range_str: Optional[str]) -> Optional[bool]:
+    """
+    Compares a test value string to a reference range string.
+    Returns True (out of range), False (in range), None (cannot compare).
+    """
+    row = classify_range(value_str, range_str)
+    return flag_out_of_range(*(np.array([x]) for x in row))[0]
 
 
 # --- Main Orchestrator Function --- (No changes needed here conceptually)
+# Binarization can wipe out faint or low-contrast text; below this many characters the
+# grayscale image is OCR'd as well
+MIN_BINARIZED_OCR_CHARS = 20
+
+# Re-uploads of the same image (retries, double submits) are answered from an in-memory LRU
+# cache keyed by a hash of the image bytes. Each server process has its own cache.
+RESULT_CACHE_SIZE = int(os.environ.get("RESULT_CACHE_SIZE", 512))
+_RESULT_CACHE: "LRUCache[bytes, List[Dict[str, Any]]]" = LRUCache(maxsize=RESULT_CACHE_SIZE)
+_RESULT_CACHE_LOCK = threading.Lock() # LRUCache is not thread-safe and reports are processed on several threads
+
 def process_lab_report(image_bytes: bytes) -> List[LabTest]:
     """
     Main orchestrator function for processing the lab report image using Pillow.
     """
-    print("Starting lab report processing (Pillow)...")
-    final_results = []
+    logger.debug("Starting lab report processing (Pillow)...")
+    cache_key = blake3.blake3(image_bytes).digest()
+    with _RESULT_CACHE_LOCK:
+        cached_items = _RESULT_CACHE.get(cache_key)
+    if cached_items is not None:
+        logger.debug("Result cache hit. Returning %d cached LabTest objects.", len(cached_items))
+        return [LabTest.model_construct(**item) for item in cached_items]
+
     try:
         # Uses Pillow-based preprocessing now
         preprocessed_img : Image.Image = preprocess_image(image_bytes)
-        # Passes Pillow image to OCR
-        ocr_text = perform_ocr(preprocessed_img)
-        parsed_items = parse_text_data(ocr_text)
-
-        for item in parsed_items:
-            value_str = item.get("test_value")
-            range_str = item.get("bio_reference_range")
-            out_of_range = calculate_out_of_range(value_str, range_str)
-
-            lab_test = LabTest(
-                test_name=item.get("test_name", "Unknown"),
-                test_value=value_str,
-                bio_reference_range=range_str,
-                test_unit=item.get("test_unit"),
+        # Passes the binarized Pillow image to OCR, also trying grayscale if it reads too little
+        ocr_text = perform_ocr(binarize_image(preprocessed_img))
+        if len(ocr_text.strip()) < MIN_BINARIZED_OCR_CHARS:
+            logger.debug("Binarized OCR returned too little text, retrying on grayscale image.")
+            gray_text = perform_ocr(preprocessed_img)
+            # Keep whichever read more: a short crop ("HIV Non Reactive") may be all there is
+            if len(gray_text.strip()) > len(ocr_text.strip()):
+                ocr_text = gray_text
+        parsed_items = list(parse_text_data(ocr_text))
+        logger.debug("Parsing finished. Found %d potential test entries.", len(parsed_items))
+
+        # Classify every row first, then compare them all in one vectorized call
+        out_of_range_flags = flag_out_of_range(*classify_ranges(parsed_items))
+
+        # Every field is already a str/bool/None, so Pydantic validation is skipped
+        final_results = [
+            LabTest.model_construct(
+                test_name=item["test_name"],
+                test_value=item["test_value"],
+                bio_reference_range=item["bio_reference_range"],
+                test_unit=item["test_unit"],
                 lab_test_out_of_range=out_of_range
             )
-            final_results.append(lab_test)
+            for item, out_of_range in zip(parsed_items, out_of_range_flags)
+        ]
 
-        print(f"Processing complete (Pillow). Generated {len(final_results)} LabTest objects.")
+        logger.info("Processing complete (Pillow). Generated %d LabTest objects.", len(final_results))
+        # Only successful runs are cached; failures fall through to the except below
+        with _RESULT_CACHE_LOCK:
+            _RESULT_CACHE[cache_key] = [lab_test.model_dump() for lab_test in final_results]
         return final_results
 
     except Exception as e:
-        print(f"Error in process_lab_report pipeline (Pillow): {e}")
-        print(traceback.format_exc())
-        return [] # Return empty list on failure
\ No newline at end of file
+        logger.exception("Error in process_lab_report pipeline (Pillow): %s", e) # Includes the full traceback
+        return [] # Return empty list on failure
+
+def process_lab_reports(images: List[bytes]) -> List[List[LabTest]]:
+    """
+    Processes several lab report images in parallel.
+    Returns one list of LabTest objects per image, in input order.
+    """
+    # Threads rather than processes: tesserocr releases the GIL while recognising, so the
+    # workers share this process's API pool (and loaded models); no more than
+    # OCR_POOL_SIZE reports can be OCR'd at once anyway.
+    with ThreadPoolExecutor(max_workers=max(1, min(OCR_POOL_SIZE, len(images))), thread_name_prefix="ocr-batch") as executor:
+        return list(executor.map(process_lab_report, images))
\ No newline at end of file
@@ -0,0 +1,157 @@
+# tests/baseline_parsing.py
+# Frozen copy of the original parsing and range logic from processing.py (before the
+# performance work), used as the reference in test_parsing_baseline.py. Only the print()
+# calls were removed. Do not optimize this file: any change to the behaviour of
+# parse_text_data or calculate_out_of_range must show up as a test failure first.
+from typing import List, Optional, Dict, Any
+import re
+
+
+# --- Step 4: Core Parsing Logic ---
+# Define Regex Patterns (Compile for efficiency)
+VALUE_RE = re.compile(r'(\b\d+\.\d+\b|\b\d+\b|\b[Pp]ositive\b|\b[Nn]egative\b|\b[Dd]etected\b|\b[Nn]on [Rr]eactive\b|\b[Rr]eactive\b|\b[Nn]ormal\b|\b[Aa]bnornmal\b)', re.IGNORECASE)
+UNIT_RE = re.compile(r'\b(%|g/dL|gm/dL|mg/dL|Seconds|U/L|IU/L|fl|fL|cu\.?mm|cells/µL|cells/ul|million/cu\.?mm|mEq/Litre|mmol/L|pg/mL|ng/mL|H\.P\.F\.|/HPF)\b', re.IGNORECASE)
+RANGE_RE = re.compile(r'(\b\d+\.?\d*\s*-\s*\d+\.?\d*\b|<\s*\d+\.?\d*|>\s*\d+\.?\d*|\b\d+-\d+\b|[Uu]p [Tt]o \d+\.?\d*|\b[Nn]egative\b|\b[Nn]ormal\b)', re.IGNORECASE)
+IGNORE_KEYWORDS = ["test", "investigation", "result", "unit", "range", "reference", "interval", "method", "specimen", "serum", "plasma", "blood", "urine", "report", "page", "date", "patient", "doctor", "hospital", "pathology", "signature", "-------", "======", "*******", "end of report", "authorized", "technologist"]
+
+def is_likely_header_or_footer(line: str) -> bool:
+    """Checks if a line is likely ignorable header/footer content."""
+    line_lower = line.strip().lower()
+    if not line_lower: # Skip empty lines
+        return True
+    if any(keyword in line_lower for keyword in IGNORE_KEYWORDS) and len(line_lower.split()) < 5 :
+         if re.fullmatch(r'test(\s+name)?\s+result\s+unit\s+(bio\.\s+)?ref.*range.*', line_lower):
+             return True
+         if re.fullmatch(r'investigation\s+result\s+unit\s+range.*', line_lower):
+             return True
+         if all(c in '- =_*' for c in line_lower):
+            return True
+    return False
+
+def parse_text_data(text: str) -> List[Dict[str, Any]]:
+    """
+    Parses raw OCR text to extract structured lab test data using regex and heuristics.
+    Focuses on lines that appear to contain test results in a semi-tabular format.
+    """
+    results = []
+    lines = text.splitlines()
+    potential_test_name = None
+
+    for i, line in enumerate(lines):
+        line = line.strip()
+
+        if is_likely_header_or_footer(line):
+            potential_test_name = None
+            continue
+
+        value_match = VALUE_RE.search(line)
+        unit_match = UNIT_RE.search(line)
+        range_match = RANGE_RE.search(line)
+
+        if value_match:
+            value_str = value_match.group(1).strip()
+            value_start_index = value_match.start()
+            current_test_name = "Unknown"
+            unit_str = None
+            range_str = None
+
+            if unit_match:
+                unit_str = unit_match.group(1).strip()
+
+            if range_match:
+                 if range_match.start() > value_start_index:
+                     range_str = range_match.group(1).strip()
+
+            possible_name_part = line[:value_start_index].strip()
+            cleaned_name = re.sub(r'[^\w\s\(\)-]+$', '', possible_name_part).strip()
+
+            if cleaned_name and len(cleaned_name) > 2:
+                 if not cleaned_name and i > 0 and not is_likely_header_or_footer(lines[i-1]) and not VALUE_RE.search(lines[i-1]):
+                     potential_previous_name = lines[i-1].strip()
+                     if re.match(r'^[A-Za-z\s\(\)\-]+', potential_previous_name):
+                           current_test_name = potential_previous_name
+                     else:
+                           current_test_name = "Unknown - Check Previous"
+                 else:
+                     current_test_name = cleaned_name
+                     potential_test_name = None
+
+                 if not re.search(r'[a-zA-Z]{3,}', current_test_name):
+                     continue
+
+            elif potential_test_name:
+                 current_test_name = potential_test_name
+                 potential_test_name = None
+            else:
+                 continue
+
+            extracted = {
+                "test_name": current_test_name,
+                "test_value": value_str,
+                "test_unit": unit_str,
+                "bio_reference_range": range_str
+            }
+            results.append(extracted)
+
+        else:
+             line_trimmed = line.strip()
+             if len(line_trimmed) > 3 and re.match(r'^[A-Za-z\s\(\)\-\#]+', line_trimmed) and not range_match and not unit_match:
+                  potential_test_name = line_trimmed
+             else:
+                  potential_test_name = None
+
+    return results
+
+
+# --- Step 5: Range Calculation Logic ---
+def calculate_out_of_range(value_str: Optional[str], range_str: Optional[str]) -> Optional[bool]:
+    """
+    Compares a test value string to a reference range string.
+    Returns True (out of range), False (in range), None (cannot compare).
+    """
+    if value_str is None or range_str is None:
+        return None
+
+    value_str_lower = value_str.strip().lower()
+    range_str_lower = range_str.strip().lower()
+
+    if value_str_lower in ["positive", "detected", "reactive"]:
+        return True if range_str_lower == "negative" else None
+    if value_str_lower == "negative":
+        return False if range_str_lower == "negative" else None
+    if range_str_lower in ["negative", "normal"] and not value_str_lower in ["negative", "normal"]:
+         return None
+
+    try:
+        cleaned_value_str = re.sub(r'[<>]', '', value_str.strip())
+        value_num = float(cleaned_value_str)
+    except ValueError:
+        return None
+
+    try:
+        match = re.search(r'(\d+\.?\d*)\s*-\s*(\d+\.?\d*)', range_str)
+        if match:
+            lower, upper = float(match.group(1)), float(match.group(2))
+            return not (lower <= value_num <= upper)
+
+        match = re.search(r'<\s*(\d+\.?\d*)', range_str)
+        if match:
+            upper = float(match.group(1))
+            return value_num >= upper
+
+        match = re.search(r'>\s*(\d+\.?\d*)', range_str)
+        if match:
+            lower = float(match.group(1))
+            return value_num <= lower
+
+        match = re.search(r'[Uu]p [Tt]o (\d+\.?\d*)', range_str, re.IGNORECASE)
+        if match:
+            upper = float(match.group(1))
+            return value_num > upper
+
+    except ValueError:
+        return None
+    except Exception as e:
+        return None
+
+    return None
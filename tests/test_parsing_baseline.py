@@ -0,0 +1,80 @@
+# tests/test_parsing_baseline.py
+# Differential test: the optimized parsing and range logic in processing.py must give exactly
+# the same results as the original implementation (tests/baseline_parsing.py) on randomized
+# OCR-like text. Run from the project directory with: python -m pytest -q
+import random
+
+import pytest
+
+import baseline_parsing as baseline
+
+try:
+    import processing
+except (ImportError, RuntimeError) as e: # tesserocr missing, or no 'eng' traineddata (see TESSDATA_PREFIX)
+    pytest.skip(f"processing needs tesserocr with the 'eng' language data: {e}", allow_module_level=True)
+
+# Tokens the random lines are built from: test names, values, units, ranges, header/footer
+# words, separators, punctuation, plus non-ASCII digits and letters that the regexes treat
+# specially ('٣' is a \d digit, 'ſ' case-folds to 's')
+VOCAB = [
+    "Hemoglobin", "HEMOGLOBIN", "Platelet", "Count", "WBC", "TOTAL", "Glucose", "Fasting", "Serum",
+    "C-REACTIVE", "PROTEIN,", "CRP", "(SGPT)", "Kelvin",
+    "14.5", "16.17", "1", "0", "150", "7000", "12a", "5mg",
+    "13.5-17.5", "13.5 - 17.5", "150-450", "70-110", "4000 - 11000", "<0.5", "> 10", "<5.7", "Up to 40", "up to 4.5",
+    "g/dL", "mg/dL", "%", "U/L", "IU/L", "fL", "cells/µL", "million/cu.mm", "mEq/Litre", "/HPF", "H.P.F.",
+    "Positive", "NEGATIVE", "Negative", "Detected", "Non Reactive", "Reactive", "Normal", "Abnornmal",
+    "test", "result", "unit", "range", "reference", "Bio.", "Ref.", "Test Name", "Investigation", "Result",
+    "Unit", "Range", "Interval", "Page", "end of report",
+    "-------", "======", "*******", "-", "*", ":", "#",
+    "ſ", "٣",
+]
+
+# A hand-written report covering the common layouts (same-line names, names on the line
+# above, header rows, separators, text results)
+REPORT = """Test Name Result Unit Bio. Ref. Range
+investigation result unit range
+HEMOGLOBIN 14.5 g/dL 13.5-17.5
+PLATELET COUNT 150 thousand/cu.mm 150-450
+C-REACTIVE PROTEIN, CRP 16.17 mg/dl <0.5
+HbA1c <5.7 %
+Glucose 70-110
+-------
+====== ======
+Vitamin <5mg
+HIV Non Reactive
+HBsAg
+Negative Negative
+SGPT (ALT)
+ 42 U/L Up to 40
+Urine Pus Cells 2-3 /HPF 0-5
+end of report
+\f"""
+
+def random_texts(count: int, seed: int):
+    rng = random.Random(seed)
+    for _ in range(count):
+        lines = []
+        for _ in range(rng.randint(0, 12)):
+            words = (rng.choice(VOCAB) for _ in range(rng.randint(0, 7)))
+            lines.append((" " * rng.randint(0, 2)).join(words) + rng.choice(["", " ", "  "]))
+        yield rng.choice(["\n", "\r\n", "\n\n"]).join(lines)
+
+def test_parse_text_data_matches_baseline_on_report():
+    assert list(processing.parse_text_data(REPORT)) == baseline.parse_text_data(REPORT)
+
+@pytest.mark.parametrize("seed", range(3))
+def test_parse_text_data_matches_baseline(seed):
+    for text in random_texts(3000, seed):
+        assert list(processing.parse_text_data(text)) == baseline.parse_text_data(text), repr(text)
+
+VALUES = ["14.5", "<5.7", "150", "0", "16.17", " 12 ", "nan", "inf", "abc", None,
+          "Positive", "positive", "Negative", "NEGATIVE", "Normal", "Detected", "Reactive", "Non Reactive", "Abnornmal"]
+RANGES = ["13.5-17.5", "13.5 - 17.5", "150-450", "0-5", "2-3", "12.-3", "<0.5", " <5 ", "> 10", "Up to 40", "up to 4.5",
+          "Negative", "negative", "Normal", "x", None]
+
+@pytest.mark.parametrize("value_str", VALUES)
+@pytest.mark.parametrize("range_str", RANGES)
+def test_calculate_out_of_range_matches_baseline(value_str, range_str):
+    expected = baseline.calculate_out_of_range(value_str, range_str)
+    result = processing.calculate_out_of_range(value_str, range_str)
+    assert result == expected and type(result) is type(expected)